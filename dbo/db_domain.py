@@ -1,16 +1,85 @@
-from app.dbo.get_db_connection import get_db_connection
+from app.dbo.get_db_connection import threaded
 import MySQLdb
 
+DOMAIN_COLUMNS = (
+    "domain_name",
+    "tld",
+    "primary_mx",
+    "spf_record",
+    "dmarc_record",
+    "days_since_creation",
+    "new_domain",
+    "disposable",
+    "spam",
+    "phishing",
+    "suspicious",
+    "catch_all",
+    "spoofable",
+    "dns_checked_at",
+    "whois_checked_at",
+    "spam_checked_at",
+    "catch_all_checked_at",
+    "dnsbl_categories",
+)
 
-async def insert_or_update(domain_info):
-    conn = get_db_connection()
+TEXT_COLUMNS = ("primary_mx", "spf_record", "dmarc_record")
+
+BOOLEAN_COLUMNS = (
+    "new_domain",
+    "disposable",
+    "spam",
+    "phishing",
+    "suspicious",
+    "catch_all",
+    "spoofable",
+)
+
+
+def row_to_dict(row) -> dict:
+    """Map a domains row back to the values the checks return."""
+    domain = dict(zip(DOMAIN_COLUMNS, row))
+    for column in TEXT_COLUMNS:
+        # Missing records are returned as False by the checks and stored as "0"
+        if domain[column] in (None, "0"):
+            domain[column] = False
+    for column in BOOLEAN_COLUMNS:
+        if domain[column] is not None:
+            domain[column] = bool(domain[column])
+    return domain
+
+
+@threaded
+def fetch(conn, domain: str):
+    """Return the stored row for a domain as a dict, or None if it is unknown."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"""
+            SELECT {", ".join(DOMAIN_COLUMNS)} FROM domains WHERE domain_name = %s
+            """,
+            (domain,),
+        )
+        result = cursor.fetchone()
+        if result:
+            return row_to_dict(result)
+        return None
+    except MySQLdb.Error as e:
+        print(f"MySQL Error during domain fetch: {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+@threaded
+def insert_or_update(conn, domain_info):
     cursor = conn.cursor()
     try:
         cursor.execute(
             """
-            INSERT INTO domains (domain_name, tld, primary_mx, spf_record, dmarc_record, days_since_creation, 
-            new_domain, disposable, spam, phishing, suspicious, catch_all)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            INSERT INTO domains (domain_name, tld, primary_mx, spf_record, dmarc_record, days_since_creation,
+            new_domain, disposable, spam, phishing, suspicious, catch_all, spoofable, dns_checked_at,
+            whois_checked_at, spam_checked_at, catch_all_checked_at, dnsbl_categories)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             ON DUPLICATE KEY UPDATE
             tld = VALUES(tld),
             primary_mx = VALUES(primary_mx),
@@ -22,7 +91,13 @@ async def insert_or_update(domain_info):
             spam = VALUES(spam),
             phishing = VALUES(phishing),
             suspicious = VALUES(suspicious),
-            catch_all = VALUES(catch_all)
+            catch_all = VALUES(catch_all),
+            spoofable = VALUES(spoofable),
+            dns_checked_at = VALUES(dns_checked_at),
+            whois_checked_at = VALUES(whois_checked_at),
+            spam_checked_at = VALUES(spam_checked_at),
+            catch_all_checked_at = VALUES(catch_all_checked_at),
+            dnsbl_categories = VALUES(dnsbl_categories)
             """,
             domain_info,
         )
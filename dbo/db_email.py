@@ -1,9 +1,9 @@
-from app.dbo.get_db_connection import get_db_connection
+from app.dbo.get_db_connection import threaded
 import MySQLdb
 
 
-async def insert_or_update(email_info):
-    conn = get_db_connection()
+@threaded
+def insert_or_update(conn, email_info):
     cursor = conn.cursor()
     try:
         cursor.execute(
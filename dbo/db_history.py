@@ -1,4 +1,4 @@
-from app.dbo.get_db_connection import get_db_connection
+from app.dbo.get_db_connection import threaded
 import MySQLdb
 from typing import Tuple
 from datetime import datetime
@@ -9,8 +9,8 @@ def datetime_to_string(datetime) -> str:
     return datetime.strftime("%Y-%m-%dT%H:%M:%S") if datetime else None
 
 
-async def check(email: str) -> Tuple[str, str]:
-    conn = get_db_connection()
+@threaded
+def check(conn, email: str) -> Tuple[str, str]:
     cursor = conn.cursor()
     try:
         cursor.execute(
@@ -0,0 +1,213 @@
+from app.dbo.get_db_connection import threaded
+import MySQLdb
+
+INSERT_BATCH_SIZE = 500
+
+
+@threaded
+def create(conn, job_id: str, priority: int, max_concurrency: int, items: list):
+    """
+    Store a job and its items in one transaction. Each item is a tuple of
+    (position, email_address, canonical_address, status, result).
+    """
+    conn.autocommit(False)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO jobs (id, priority, max_concurrency, total_items)
+            VALUES (%s, %s, %s, %s)
+            """,
+            (job_id, priority, max_concurrency, len(items)),
+        )
+        for start in range(0, len(items), INSERT_BATCH_SIZE):
+            cursor.executemany(
+                """
+                INSERT INTO job_items (job_id, position, email_address, canonical_address,
+                status, result)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                """,
+                [(job_id, *item) for item in items[start : start + INSERT_BATCH_SIZE]],
+            )
+        conn.commit()
+        return True
+    except MySQLdb.Error as e:
+        print(f"MySQL Error during job insert: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+
+
+@threaded
+def progress(conn, job_id: str):
+    """Return the job row and a count of its items per status, or None."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT priority, max_concurrency, total_items, created_at FROM jobs WHERE id = %s
+            """,
+            (job_id,),
+        )
+        job = cursor.fetchone()
+        if not job:
+            return None
+        cursor.execute(
+            """
+            SELECT status, COUNT(*) FROM job_items WHERE job_id = %s GROUP BY status
+            """,
+            (job_id,),
+        )
+        return job, dict(cursor.fetchall())
+    except MySQLdb.Error as e:
+        print(f"MySQL Error during job progress: {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+@threaded
+def results(conn, job_id: str, offset: int, limit: int):
+    """Return a page of the items of a job, or None if the job is unknown."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1 FROM jobs WHERE id = %s", (job_id,))
+        if not cursor.fetchone():
+            return None
+        cursor.execute(
+            """
+            SELECT position, email_address, status, result FROM job_items
+            WHERE job_id = %s ORDER BY position LIMIT %s OFFSET %s
+            """,
+            (job_id, limit, offset),
+        )
+        return cursor.fetchall()
+    except MySQLdb.Error as e:
+        print(f"MySQL Error during job results: {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+@threaded
+def claim(conn, priority: int, worker_id: str):
+    """
+    Claim the first pending item of the oldest job of the given priority that
+    is below its concurrency cap. Claiming is a conditional update, so when
+    several workers race for the same item only one of them gets it.
+    """
+    cursor = conn.cursor()
+    try:
+        # Both subqueries are ranges of idx_job_items_job_status for one job
+        cursor.execute(
+            """
+            SELECT j.id FROM jobs j
+            WHERE j.priority = %s
+            AND EXISTS (
+                SELECT 1 FROM job_items p
+                WHERE p.job_id = j.id AND p.status = 'pending'
+            )
+            AND (
+                SELECT COUNT(*) FROM job_items r
+                WHERE r.job_id = j.id AND r.status = 'running'
+            ) < j.max_concurrency
+            ORDER BY j.created_at
+            LIMIT 1
+            """,
+            (priority,),
+        )
+        job = cursor.fetchone()
+        if not job:
+            return None
+        job_id = job[0]
+        cursor.execute(
+            """
+            SELECT position, email_address, canonical_address, attempts
+            FROM job_items
+            WHERE job_id = %s AND status = 'pending'
+            ORDER BY position
+            LIMIT 5
+            """,
+            (job_id,),
+        )
+        for position, email, canonical, attempts in cursor.fetchall():
+            cursor.execute(
+                """
+                UPDATE job_items
+                SET status = 'running', claimed_by = %s, claimed_at = NOW(),
+                attempts = attempts + 1
+                WHERE job_id = %s AND position = %s AND status = 'pending'
+                """,
+                (worker_id, job_id, position),
+            )
+            if cursor.rowcount == 1:
+                return job_id, position, email, canonical, attempts + 1
+        return None
+    except MySQLdb.Error as e:
+        print(f"MySQL Error during job item claim: {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+@threaded
+def complete(
+    conn, job_id: str, position: int, canonical: str, status: str, result: str
+):
+    """Store the result of an item and of the duplicates of its mailbox."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            UPDATE job_items SET status = %s, result = %s
+            WHERE job_id = %s AND (
+                position = %s OR (canonical_address = %s AND status = 'duplicate')
+            )
+            """,
+            (status, result, job_id, position, canonical),
+        )
+    except MySQLdb.Error as e:
+        print(f"MySQL Error during job item update: {e}")
+    cursor.close()
+
+
+@threaded
+def release(conn, job_id: str, position: int):
+    """Put a claimed item back in the queue so another worker can retry it."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            UPDATE job_items SET status = 'pending', claimed_by = NULL, claimed_at = NULL
+            WHERE job_id = %s AND position = %s
+            """,
+            (job_id, position),
+        )
+    except MySQLdb.Error as e:
+        print(f"MySQL Error during job item release: {e}")
+    cursor.close()
+
+
+@threaded
+def requeue_expired(conn, lease_seconds: int) -> int:
+    """
+    Put items back in the queue whose worker has held them for longer than the
+    lease, e.g. because the node running it crashed. Finished items are never
+    touched, so resumed jobs only redo the work that was in flight.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            UPDATE job_items SET status = 'pending', claimed_by = NULL, claimed_at = NULL
+            WHERE status = 'running' AND claimed_at < NOW() - INTERVAL %s SECOND
+            """,
+            (lease_seconds,),
+        )
+        return cursor.rowcount
+    except MySQLdb.Error as e:
+        print(f"MySQL Error during job item requeue: {e}")
+        return 0
+    finally:
+        cursor.close()
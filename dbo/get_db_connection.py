@@ -1,5 +1,7 @@
+import functools
 import os
 import MySQLdb
+from app.diagnostics import profiling
 
 
 def get_db_connection():
@@ -19,3 +21,26 @@ def get_db_connection():
 
     except MySQLdb.Error as e:
         print("MySQL Error:", e)
+
+
+def threaded(query):
+    """
+    Turn a blocking query function, taking a connection as its first argument,
+    into a coroutine that runs it in a worker thread on its own connection and
+    closes that connection afterwards.
+    """
+
+    @functools.wraps(query)
+    async def run(*args):
+        def call():
+            conn = get_db_connection()
+            try:
+                return query(conn, *args)
+            finally:
+                conn.close()
+
+        return await profiling.to_thread(
+            call, name=f"mysql {query.__module__.rsplit('.', 1)[-1]}.{query.__name__}"
+        )
+
+    return run
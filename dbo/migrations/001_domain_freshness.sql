@@ -0,0 +1,8 @@
+-- Track when each group of domain fields was last looked up so the domains
+-- table can be reused as a cache, with per-field freshness windows.
+ALTER TABLE domains
+    ADD COLUMN spoofable BOOLEAN NULL,
+    ADD COLUMN dns_checked_at DATETIME NULL,
+    ADD COLUMN whois_checked_at DATETIME NULL,
+    ADD COLUMN spam_checked_at DATETIME NULL,
+    ADD COLUMN catch_all_checked_at DATETIME NULL;
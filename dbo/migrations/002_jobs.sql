@@ -0,0 +1,24 @@
+-- Asynchronous verification jobs. A job is a submitted list of addresses,
+-- each address is a job item that background workers claim and complete.
+CREATE TABLE jobs (
+    id CHAR(32) NOT NULL PRIMARY KEY,
+    priority TINYINT NOT NULL DEFAULT 1,
+    max_concurrency INT NOT NULL DEFAULT 4,
+    total_items INT NOT NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_jobs_priority_created (priority, created_at)
+);
+
+CREATE TABLE job_items (
+    job_id CHAR(32) NOT NULL,
+    position INT NOT NULL,
+    email_address VARCHAR(320) NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    claimed_by VARCHAR(64) NULL,
+    claimed_at DATETIME NULL,
+    result JSON NULL,
+    PRIMARY KEY (job_id, position),
+    INDEX idx_job_items_job_status (job_id, status, position),
+    INDEX idx_job_items_status_claimed (status, claimed_at)
+);
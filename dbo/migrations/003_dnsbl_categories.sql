@@ -0,0 +1,4 @@
+-- Categories the DNSBL zones list a domain under, as comma separated
+-- zone:category pairs, e.g. "spamhaus_dbl:phishing,surbl:phishing".
+ALTER TABLE domains
+    ADD COLUMN dnsbl_categories VARCHAR(255) NULL;
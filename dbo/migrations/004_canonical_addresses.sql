@@ -0,0 +1,5 @@
+-- Canonical mailbox keys of job items, so equivalent spellings of an address
+-- in one job are only checked once.
+ALTER TABLE job_items
+    ADD COLUMN canonical_address VARCHAR(320) NULL,
+    ADD INDEX idx_job_items_job_canonical (job_id, canonical_address);
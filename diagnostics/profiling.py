@@ -0,0 +1,255 @@
+import asyncio
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+# Runtime switch, changed by operators through the admin API
+settings = {
+    "enabled": False,
+    "sample_rate": 0.01,
+    "block_threshold_ms": 100,
+}
+
+SAMPLE_INTERVAL = 0.005
+MAX_ACTIVE = 2
+
+# The last profiles taken, oldest dropped first
+profiles = deque(maxlen=int(os.environ.get("PROFILE_BUFFER_SIZE", 20)))
+
+_active = 0
+_cpu_profiler_busy = False
+
+# Worker thread time of the profiled request, name -> [calls, seconds]
+_offloads = contextvars.ContextVar("offloads", default=None)
+
+
+def _stack(frame, lines: bool = False) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        name = f"{code.co_name} ({os.path.basename(code.co_filename)}"
+        names.append(f"{name}:{frame.f_lineno})" if lines else f"{name})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _awaited(awaitable):
+    for attribute in ("cr_await", "gi_yieldfrom", "ag_await"):
+        if hasattr(awaitable, attribute):
+            return getattr(awaitable, attribute)
+    return None
+
+
+def _frame(awaitable):
+    for attribute in ("cr_frame", "gi_frame", "ag_frame"):
+        if hasattr(awaitable, attribute):
+            return getattr(awaitable, attribute)
+    return None
+
+
+def _await_chain(task: asyncio.Task) -> str:
+    """
+    Follow a task's coroutines down to what it is awaiting, outermost first.
+    The chain ends in <running> while the task runs on the loop and in
+    <waiting> while it waits on a future, e.g. a worker thread or a socket.
+    """
+    names = []
+    awaitable = task.get_coro()
+    while True:
+        frame = _frame(awaitable)
+        if frame is None:
+            names.append("<waiting>")
+            break
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        awaitable = _awaited(awaitable)
+        if awaitable is None:
+            names.append("<running>")
+            break
+    return ";".join(names)
+
+
+class _Sampler(threading.Thread):
+    """
+    Samples the await chain of the profiled task for a wall-clock profile and
+    records spans in which the loop's heartbeat stalled for longer than the
+    threshold, with the loop thread's stack that was blocking it.
+    """
+
+    def __init__(self, task: asyncio.Task, thread_id: int, threshold: float):
+        super().__init__(daemon=True)
+        self.task = task
+        self.thread_id = thread_id
+        self.threshold = threshold
+        self.started = time.monotonic()
+        self.last_beat = self.started
+        self.samples = Counter()
+        self.blocking_spans = []
+        self.stopping = threading.Event()
+
+    def run(self):
+        blocked_since = None
+        blocked_stack = None
+        while not self.stopping.wait(SAMPLE_INTERVAL):
+            if not self.task.done():
+                self.samples[_await_chain(self.task)] += 1
+
+            last_beat = self.last_beat
+            if time.monotonic() - last_beat > self.threshold:
+                frame = sys._current_frames().get(self.thread_id)
+                if blocked_since is None and frame is not None:
+                    blocked_since, blocked_stack = last_beat, _stack(frame, True)
+            elif blocked_since is not None:
+                self._close_span(blocked_since, last_beat, blocked_stack)
+                blocked_since = None
+
+        if blocked_since is not None:
+            self._close_span(blocked_since, time.monotonic(), blocked_stack)
+
+    def _close_span(self, start: float, end: float, stack: str):
+        self.blocking_spans.append(
+            {
+                "offset_ms": round((start - self.started) * 1000, 1),
+                "duration_ms": round((end - start) * 1000, 1),
+                "stack": stack,
+            }
+        )
+
+
+async def _heartbeat(sampler: _Sampler):
+    while True:
+        sampler.last_beat = time.monotonic()
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+async def to_thread(func, /, *args, name: str = None):
+    """
+    Run a blocking call with asyncio.to_thread. Inside a profiled request the
+    time spent waiting on it is added to the request's profile under `name`.
+    """
+    offloads = _offloads.get()
+    if offloads is None:
+        return await asyncio.to_thread(func, *args)
+    started = time.perf_counter()
+    try:
+        return await asyncio.to_thread(func, *args)
+    finally:
+        calls = offloads.setdefault(name or func.__qualname__, [0, 0.0])
+        calls[0] += 1
+        calls[1] += time.perf_counter() - started
+
+
+def _wanted(forced: bool) -> bool:
+    if _active >= MAX_ACTIVE:
+        return False
+    return forced or random.random() < settings["sample_rate"]
+
+
+@asynccontextmanager
+async def profile(path: str, forced: bool = False):
+    """
+    Profile the wrapped code when the switch is on and the request is sampled,
+    or when it was flagged by an operator. Otherwise this does nothing.
+
+    The wall-clock profile and the worker thread times belong to the calling
+    task. cProfile and CPU time cover the whole loop thread, including other
+    requests running at the same time, and are reported as loop_cpu.
+    """
+    global _active, _cpu_profiler_busy
+
+    if not (forced or settings["enabled"]) or not _wanted(forced):
+        yield
+        return
+
+    _active += 1
+    sampler = _Sampler(
+        asyncio.current_task(),
+        threading.get_ident(),
+        settings["block_threshold_ms"] / 1000,
+    )
+    heartbeat = asyncio.create_task(_heartbeat(sampler))
+
+    # cProfile hooks the whole thread, so only one request uses it at a time
+    cpu_profiler = None
+    if not _cpu_profiler_busy:
+        _cpu_profiler_busy = True
+        cpu_profiler = cProfile.Profile()
+
+    offloads = {}
+    offloads_token = _offloads.set(offloads)
+
+    started_at = datetime.now()
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    sampler.start()
+    if cpu_profiler:
+        cpu_profiler.enable()
+    try:
+        yield
+    finally:
+        _offloads.reset(offloads_token)
+        if cpu_profiler:
+            cpu_profiler.disable()
+            _cpu_profiler_busy = False
+        wall_time, cpu_time = (
+            time.perf_counter() - wall_start,
+            time.thread_time() - cpu_start,
+        )
+        sampler.stopping.set()
+        heartbeat.cancel()
+        _active -= 1
+        await asyncio.to_thread(sampler.join)
+
+        cpu_profile = None
+        if cpu_profiler:
+            stream = io.StringIO()
+            stats = pstats.Stats(cpu_profiler, stream=stream)
+            stats.sort_stats("cumulative").print_stats(50)
+            cpu_profile = stream.getvalue()
+
+        profiles.append(
+            {
+                "id": uuid.uuid4().hex[:12],
+                "path": path,
+                "started_at": started_at.strftime("%Y-%m-%dT%H:%M:%S"),
+                "wall_ms": round(wall_time * 1000, 1),
+                "loop_cpu_ms": round(cpu_time * 1000, 1),
+                "offloads": {
+                    name: {"calls": calls, "total_ms": round(seconds * 1000, 1)}
+                    for name, (calls, seconds) in offloads.items()
+                },
+                "blocking_spans": sampler.blocking_spans,
+                "wall_clock": "\n".join(
+                    f"{stack} {count}" for stack, count in sampler.samples.items()
+                ),
+                "loop_cpu_profile": cpu_profile,
+            }
+        )
+
+
+def summary() -> list:
+    """The buffered profiles without their stacks, newest first."""
+    return [
+        {
+            "id": p["id"],
+            "path": p["path"],
+            "started_at": p["started_at"],
+            "wall_ms": p["wall_ms"],
+            "loop_cpu_ms": p["loop_cpu_ms"],
+            "blocking_spans": len(p["blocking_spans"]),
+        }
+        for p in reversed(profiles)
+    ]
+
+
+def find(profile_id: str):
+    return next((p for p in profiles if p["id"] == profile_id), None)
@@ -0,0 +1,198 @@
+import asyncio
+import ipaddress
+import os
+import time
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+
+# DNS blocklists, queried with a domain ("domain") or a reversed IPv4 address
+# ("ip"). Return codes are decoded either from an exact address ("codes") or
+# from the bits of the last octet ("bitmask"); "errors" are the addresses a
+# list answers with when it refuses the query rather than listing anything.
+ZONES = {
+    "spamhaus_dbl": {
+        "zone": "dbl.spamhaus.org",
+        "type": "domain",
+        "timeout": 2.0,
+        "codes": {
+            "127.0.1.2": "spam",
+            "127.0.1.4": "phishing",
+            "127.0.1.5": "malware",
+            "127.0.1.6": "botnet",
+            "127.0.1.102": "abused_spam",
+            "127.0.1.103": "abused_redirector",
+            "127.0.1.104": "abused_phishing",
+            "127.0.1.105": "abused_malware",
+            "127.0.1.106": "abused_botnet",
+        },
+        "errors": ("127.255.255.252", "127.255.255.254", "127.255.255.255"),
+    },
+    "uribl": {
+        "zone": "multi.uribl.com",
+        "type": "domain",
+        "timeout": 2.0,
+        "bitmask": {2: "spam", 4: "grey", 8: "spam"},
+        "errors": ("127.0.0.1",),
+    },
+    "surbl": {
+        "zone": "multi.surbl.org",
+        "type": "domain",
+        "timeout": 2.0,
+        "bitmask": {8: "phishing", 16: "malware", 64: "spam", 128: "compromised"},
+        "errors": (),
+    },
+    "spamhaus_zen": {
+        "zone": "zen.spamhaus.org",
+        "type": "ip",
+        "timeout": 2.0,
+        "codes": {
+            "127.0.0.2": "spam",
+            "127.0.0.3": "spam",
+            "127.0.0.4": "exploited",
+            "127.0.0.5": "exploited",
+            "127.0.0.6": "exploited",
+            "127.0.0.7": "exploited",
+            "127.0.0.9": "hijacked",
+            "127.0.0.10": "policy",
+            "127.0.0.11": "policy",
+        },
+        "errors": ("127.255.255.252", "127.255.255.254", "127.255.255.255"),
+    },
+}
+
+# Comma separated names of the zones to query, all of them by default
+ENABLED_ZONES = [
+    name.strip()
+    for name in os.environ.get("DNSBL_ZONES", ",".join(ZONES)).split(",")
+    if name.strip() in ZONES
+]
+
+# Categories that only describe a sender and do not make it a spam source
+INFORMATIONAL = {"grey", "policy"}
+
+MIN_TTL = 60
+MAX_TTL = 3600
+NEGATIVE_TTL = 900
+# How long a zone that failed or refused a query is left alone for that name
+ERROR_TTL = 60
+CACHE_SIZE = 50000
+
+resolver = dns.asyncresolver.Resolver()
+
+# (zone name, query name) -> (expires, categories), categories is None for
+# a query that failed
+_cache = {}
+
+
+def query_name(zone: dict, target: str) -> str:
+    if zone["type"] == "ip":
+        return ".".join(reversed(target.split("."))) + "." + zone["zone"]
+    return target.rstrip(".") + "." + zone["zone"]
+
+
+def decode(zone: dict, addresses: list) -> set:
+    """Decode the A records a list answered with into categories."""
+    categories = set()
+    for address in addresses:
+        if address in zone.get("errors", ()):
+            raise ValueError(f"{zone['zone']} refused the query ({address})")
+        if "codes" in zone:
+            categories.add(zone["codes"].get(address, "listed"))
+        else:
+            last_octet = int(address.split(".")[-1])
+            categories.update(
+                category
+                for bit, category in zone["bitmask"].items()
+                if last_octet & bit
+            )
+    return categories
+
+
+def _remember(key: tuple, ttl: int, categories: set):
+    now = time.monotonic()
+    if len(_cache) >= CACHE_SIZE:
+        for cached in [k for k, (expires, _) in _cache.items() if expires < now]:
+            del _cache[cached]
+        if len(_cache) >= CACHE_SIZE:
+            _cache.clear()
+    _cache[key] = (now + ttl, categories)
+
+
+async def query(name: str, target: str) -> set:
+    """
+    Look a domain or IP up in one zone and return its categories, an empty set
+    when it is not listed. Answers are cached per zone by their TTL.
+    """
+    zone = ZONES[name]
+    qname = query_name(zone, target)
+
+    cached = _cache.get((name, qname))
+    if cached and cached[0] > time.monotonic():
+        if cached[1] is None:
+            raise LookupError(f"{zone['zone']} failed recently for {qname}")
+        return cached[1]
+
+    try:
+        answer = await resolver.resolve(qname, "A", lifetime=zone["timeout"])
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        _remember((name, qname), NEGATIVE_TTL, set())
+        return set()
+
+    categories = decode(zone, [record.to_text() for record in answer])
+    _remember((name, qname), min(max(answer.rrset.ttl, MIN_TTL), MAX_TTL), categories)
+    return categories
+
+
+async def resolve_ips(host: str) -> list:
+    """Return the IPv4 addresses of a host, e.g. a domain's primary MX."""
+    try:
+        answer = await resolver.resolve(host, "A", lifetime=2.0)
+        return [record.to_text() for record in answer]
+    except dns.exception.DNSException:
+        return []
+
+
+async def check(domain: str, mx_ips: list = ()) -> dict:
+    """
+    Query every enabled zone concurrently, domain zones with the domain and IP
+    zones with the MX addresses. Each zone has its own timeout, so a slow list
+    only drops out of the result rather than holding up the rest. Returns
+    whether the domain is listed as a spam source, the categories per zone and
+    the zones that could not be queried.
+    """
+    lookups = []
+    for name in ENABLED_ZONES:
+        if ZONES[name]["type"] == "domain":
+            lookups.append((name, domain))
+        else:
+            lookups.extend(
+                (name, ip)
+                for ip in mx_ips
+                if isinstance(ipaddress.ip_address(ip), ipaddress.IPv4Address)
+            )
+
+    answers = await asyncio.gather(
+        *(
+            asyncio.wait_for(query(name, target), ZONES[name]["timeout"])
+            for name, target in lookups
+        ),
+        return_exceptions=True,
+    )
+
+    categories = {}
+    errors = set()
+    for (name, target), answer in zip(lookups, answers):
+        if isinstance(answer, Exception):
+            errors.add(name)
+            # Timeouts and refusals are not retried on every request
+            if not isinstance(answer, LookupError):
+                _remember((name, query_name(ZONES[name], target)), ERROR_TTL, None)
+        elif answer:
+            categories.setdefault(name, set()).update(answer)
+
+    return {
+        "listed": any(c - INFORMATIONAL for c in categories.values()),
+        "categories": categories,
+        "errors": sorted(errors),
+    }
@@ -0,0 +1,233 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from app.dbo import db_domain
+from app.email_functions import dnsbl, mx_spf_dmarc, smtp, whois_domain_creation
+
+# How long each group of domain fields may be reused before it is looked up
+# again. WHOIS creation dates practically never change, MX/SPF/DMARC do.
+FRESHNESS = {
+    "dns": timedelta(hours=6),
+    "whois": timedelta(weeks=4),
+    "spam": timedelta(hours=12),
+    "catch_all": timedelta(days=1),
+}
+
+# How soon a group whose lookup failed (a DNS timeout, an unreachable WHOIS
+# server) is tried again. Failures are never stored as fresh answers.
+RETRY_AFTER = timedelta(minutes=10)
+
+# Columns of the domains table filled by each group of lookups
+FIELDS = {
+    "dns": ("primary_mx", "spf_record", "dmarc_record", "spoofable"),
+    "whois": ("days_since_creation",),
+    "spam": ("spam", "dnsbl_categories"),
+    "catch_all": ("catch_all",),
+}
+
+# In-process first-level cache in front of the domains table
+CACHE_SIZE = 10000
+_cache = OrderedDict()
+
+
+def checked_at(record: dict, group: str):
+    return record.get(f"{group}_checked_at")
+
+
+def lookup_failed(record: dict, group: str) -> bool:
+    """Whether the last lookup of a group failed and waits to be retried."""
+    return record.get(f"{group}_retry_at") is not None
+
+
+def stale_groups(record: dict, now: datetime = None, lead=timedelta(0)) -> list:
+    """Return the field groups of a record that are (or within `lead` will be) stale."""
+    now = now or datetime.now()
+    stale = []
+    for group, window in FRESHNESS.items():
+        retry_at = record.get(f"{group}_retry_at")
+        if retry_at is not None and now < retry_at:
+            continue
+        last_checked = checked_at(record, group)
+        if last_checked is None or now + lead - last_checked >= window:
+            stale.append(group)
+    return stale
+
+
+def days_since_creation(record: dict, now: datetime = None) -> int:
+    """Age the stored WHOIS result by the time elapsed since it was looked up."""
+    days = record.get("days_since_creation")
+    if days is None or days < 0:
+        return -1
+    last_checked = checked_at(record, "whois")
+    if last_checked is None:
+        return days
+    return days + ((now or datetime.now()) - last_checked).days
+
+
+def _remember(domain: str, record: dict):
+    _cache[domain] = record
+    _cache.move_to_end(domain)
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def _merge(cached: dict, stored: dict) -> dict:
+    """Keep the most recently checked value of every field group."""
+    if cached is None:
+        return dict(stored)
+    merged = dict(cached)
+    for group, fields in FIELDS.items():
+        stored_at = checked_at(stored, group)
+        cached_at = checked_at(cached, group)
+        if stored_at is not None and (cached_at is None or stored_at > cached_at):
+            for field in fields:
+                merged[field] = stored[field]
+            merged[f"{group}_checked_at"] = stored_at
+    return merged
+
+
+def _looked_up(record: dict, group: str, now: datetime, failed: bool):
+    """
+    Stamp a group after a successful lookup. After a failed one, keep it stale
+    but hold off retrying it for RETRY_AFTER in this process.
+    """
+    if failed:
+        record[f"{group}_retry_at"] = now + RETRY_AFTER
+    else:
+        record[f"{group}_checked_at"] = now
+        record.pop(f"{group}_retry_at", None)
+
+
+async def _recompute(domain: str, record: dict, groups: list):
+    now = datetime.now()
+
+    if "dns" in groups:
+        *values, temporary_failure = await mx_spf_dmarc.check(domain)
+        # After a resolver timeout the last good answer is kept if there is one
+        if checked_at(record, "dns") is None or not temporary_failure:
+            (
+                record["primary_mx"],
+                record["spf_record"],
+                record["dmarc_record"],
+                record["spoofable"],
+            ) = values
+        _looked_up(record, "dns", now, temporary_failure)
+
+    if "whois" in groups:
+        days = await whois_domain_creation.check(domain)
+        if days is not None:
+            record["days_since_creation"] = days
+        elif checked_at(record, "whois") is None:
+            record["days_since_creation"] = -1
+        _looked_up(record, "whois", now, days is None)
+
+    if "spam" in groups:
+        mx_ips = []
+        if record.get("primary_mx"):
+            mx_ips = await dnsbl.resolve_ips(record["primary_mx"])
+        listing = await dnsbl.check(domain, mx_ips)
+        categories = {
+            f"{zone}:{category}"
+            for zone, zone_categories in listing["categories"].items()
+            for category in zone_categories
+        }
+        # Zones that could not be queried keep their last known categories
+        categories.update(
+            entry
+            for entry in (record.get("dnsbl_categories") or "").split(",")
+            if entry and entry.split(":")[0] in listing["errors"]
+        )
+        record["dnsbl_categories"] = ",".join(sorted(categories))
+        record["spam"] = any(
+            entry.split(":")[1] not in dnsbl.INFORMATIONAL for entry in categories
+        )
+        _looked_up(record, "spam", now, bool(listing["errors"]))
+
+    if "catch_all" in groups and "primary_mx" in record:
+        # Two random addresses accepted means the domain is a catch-all
+        _, catch_all = await smtp.check(
+            smtp.generate_random_email(domain), record["primary_mx"], domain
+        )
+        if catch_all is not None:
+            record["catch_all"] = catch_all
+            record["catch_all_checked_at"] = now
+
+
+async def check(domain: str) -> dict:
+    """
+    Return the domain-level intelligence for a domain, reusing every field group
+    that is still fresh in the in-process cache or the domains table and only
+    looking up the stale ones. The catch-all flag needs an SMTP probe, so when it
+    is stale it is returned as None and the caller sets it with `set_catch_all`.
+    """
+    record = _cache.get(domain)
+
+    if record is None or stale_groups(record):
+        stored = await db_domain.fetch(domain)
+        if stored:
+            record = _merge(record, stored)
+
+    record = dict(record) if record else {"domain_name": domain}
+    stale = stale_groups(record)
+    # The catch-all flag is left to the caller's own SMTP probe
+    await _recompute(domain, record, [group for group in stale if group != "catch_all"])
+
+    if "catch_all" in stale:
+        record["catch_all"] = None
+    else:
+        _remember(domain, dict(record))
+
+    return record
+
+
+async def refresh(domain: str, lead: timedelta) -> list:
+    """
+    Re-check the field groups of a known domain that go stale within `lead`,
+    including the catch-all probe, and write the result through both caches.
+    Returns the refreshed groups.
+    """
+    record = _cache.get(domain)
+    if record and not stale_groups(record, lead=lead):
+        return []
+
+    stored = await db_domain.fetch(domain)
+    if stored:
+        record = _merge(record, stored)
+    if not record:
+        return []
+
+    record = dict(record)
+    groups = stale_groups(record, lead=lead)
+    if groups:
+        await _recompute(domain, record, groups)
+        await save(record)
+    return groups
+
+
+def dnsbl_categories(record: dict) -> list:
+    """Return the DNSBL categories of a record, without the zone names."""
+    return sorted(
+        {
+            category.split(":")[1]
+            for category in (record.get("dnsbl_categories") or "").split(",")
+            if category
+        }
+    )
+
+
+def set_catch_all(record: dict, catch_all: bool):
+    # A probe that could not tell (None) leaves the flag stale
+    if record.get("catch_all") is None and catch_all is not None:
+        record["catch_all"] = catch_all
+        record["catch_all_checked_at"] = datetime.now()
+
+
+async def save(record: dict):
+    """Store a record in the in-process cache and write it through to the domains table."""
+    domain = record["domain_name"]
+    age = days_since_creation(record)
+    record["tld"] = domain.split(".")[-1]
+    record["new_domain"] = age < 30
+    _remember(domain, dict(record))
+    await db_domain.insert_or_update(
+        tuple(record.get(column) for column in db_domain.DOMAIN_COLUMNS)
+    )
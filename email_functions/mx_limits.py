@@ -0,0 +1,172 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+# Concurrent SMTP probes allowed per MX host and per provider group
+HOST_CONCURRENCY = int(os.environ.get("SMTP_HOST_CONCURRENCY", 4))
+GROUP_CONCURRENCY = int(os.environ.get("SMTP_GROUP_CONCURRENCY", 16))
+
+# Probes waiting for a slot beyond this many, or for longer than this, give up
+MAX_QUEUE = int(os.environ.get("SMTP_MAX_QUEUE", 50))
+QUEUE_TIMEOUT = 30
+
+# Consecutive timeouts or 4xx responses that open a host's breaker, and how
+# long it stays open before a single trial probe is let through (doubling on
+# every failed trial)
+FAILURE_THRESHOLD = 5
+BASE_BACKOFF = 30
+MAX_BACKOFF = 1800
+
+# MX hostname suffixes of large providers. Their MX hosts share throttling,
+# so they also share a concurrency limit.
+PROVIDER_GROUPS = {
+    "google.com": "google",
+    "googlemail.com": "google",
+    "outlook.com": "microsoft",
+    "hotmail.com": "microsoft",
+    "yahoodns.net": "yahoo",
+    "icloud.com": "apple",
+    "mimecast.com": "mimecast",
+    "pphosted.com": "proofpoint",
+    "messagelabs.com": "broadcom",
+    "zoho.com": "zoho",
+    "yandex.net": "yandex",
+}
+
+
+class Unavailable(Exception):
+    """Raised when a probe is refused because the breaker is open or the queue is full."""
+
+
+class CircuitBreaker:
+    def __init__(self):
+        self.state = "closed"
+        self.failures = 0
+        self.backoff = BASE_BACKOFF
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.backoff:
+            self.state = "half_open"
+        if self.state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.backoff = BASE_BACKOFF
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open":
+            self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+            self._open()
+        elif self.state == "closed" and self.failures >= FAILURE_THRESHOLD:
+            self._open()
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+
+class Limit:
+    def __init__(self, concurrency: int):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.queued = 0
+
+
+_breakers = {}
+_hosts = {}
+_groups = {}
+
+
+def provider_group(mx_host: str) -> str:
+    """Return the provider group of an MX host, or the host itself."""
+    mx_host = mx_host.lower().rstrip(".")
+    for suffix, group in PROVIDER_GROUPS.items():
+        if mx_host == suffix or mx_host.endswith("." + suffix):
+            return group
+    return mx_host
+
+
+def breaker(mx_host: str) -> CircuitBreaker:
+    return _breakers.setdefault(mx_host.lower(), CircuitBreaker())
+
+
+@asynccontextmanager
+async def _acquire(limit: Limit):
+    if limit.queued >= MAX_QUEUE:
+        raise Unavailable("queue full")
+    limit.queued += 1
+    try:
+        await asyncio.wait_for(limit.semaphore.acquire(), QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise Unavailable("timed out waiting for a slot")
+    finally:
+        limit.queued -= 1
+    limit.in_flight += 1
+    try:
+        yield
+    finally:
+        limit.in_flight -= 1
+        limit.semaphore.release()
+
+
+@asynccontextmanager
+async def slot(mx_host: str):
+    """
+    Wait for a probe slot on an MX host and its provider group. Raises
+    Unavailable straight away while the host's breaker is open.
+    """
+    host = mx_host.lower()
+    group = provider_group(host)
+    host_breaker = breaker(host)
+    if not host_breaker.allow():
+        raise Unavailable(f"circuit open for {host}")
+
+    host_limit = _hosts.setdefault(host, Limit(HOST_CONCURRENCY))
+    group_limit = _groups.setdefault(group, Limit(GROUP_CONCURRENCY))
+    try:
+        async with _acquire(group_limit), _acquire(host_limit):
+            yield host_breaker
+    finally:
+        # A trial probe that was refused, cancelled or raised without
+        # recording an outcome must not keep the breaker half open forever
+        if host_breaker.state == "half_open":
+            host_breaker.trial_in_flight = False
+
+
+def status() -> dict:
+    """Breaker state and queue depth per MX host and provider group."""
+    now = time.monotonic()
+    hosts = {}
+    for host in set(_breakers) | set(_hosts):
+        host_breaker = _breakers.get(host, CircuitBreaker())
+        host_limit = _hosts.get(host)
+        retry_in = None
+        if host_breaker.state == "open":
+            retry_in = max(
+                0, round(host_breaker.opened_at + host_breaker.backoff - now)
+            )
+        hosts[host] = {
+            "group": provider_group(host),
+            "state": host_breaker.state,
+            "failures": host_breaker.failures,
+            "retry_in": retry_in,
+            "in_flight": host_limit.in_flight if host_limit else 0,
+            "queued": host_limit.queued if host_limit else 0,
+        }
+    groups = {
+        group: {"in_flight": limit.in_flight, "queued": limit.queued}
+        for group, limit in _groups.items()
+    }
+    return {"hosts": hosts, "groups": groups}
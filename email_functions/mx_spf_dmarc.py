@@ -1,42 +1,50 @@
+import dns.asyncresolver
+import dns.exception
 import dns.resolver
+from app.email_functions import spf
 
 
 async def clean_dns_text_record(record: str) -> str:
     return record.replace('"', "").strip('"')
 
 
+# Errors that say nothing about the domain, only that DNS could not answer now
+TEMPORARY_ERRORS = (dns.exception.Timeout, dns.resolver.NoNameservers)
+
+
 async def check(domain: str):
+    """
+    Return the primary MX, SPF and DMARC records, whether the domain is
+    spoofable and whether any lookup failed temporarily (a timeout rather than
+    a missing record), in which case the other values should not be trusted.
+    """
     # Set default values to an empty string or a specific message
     mx_record = False
     spf_record = False
     dmarc_record = False
     spoofable = False
+    temporary_failure = False
 
     try:
         # Get the MX record for the domain
-        mx_records = dns.resolver.resolve(domain, "MX")
+        mx_records = await dns.asyncresolver.resolve(domain, "MX")
         mx_record = str(mx_records[0].exchange).rstrip(".")
+    except TEMPORARY_ERRORS:
+        temporary_failure = True
     except:
         pass
 
-    try:
-        # Get the SPF record for the domain
-        spf_records = dns.resolver.resolve(domain, "TXT")
-        for txt_record in spf_records:
-            if txt_record.to_text().startswith('"v=spf1'):
-                spf_record_raw = txt_record.to_text()
-                spf_record = await clean_dns_text_record(spf_record_raw)
-                # Check if the SPF policy is too permissive
-                if "+all" in spf_record_raw:
-                    spoofable = True
-                break
-    except:
-        # No SPF record found, domain might be spoofable
+    # Evaluate the SPF record, following includes and redirects, and check if
+    # the effective policy is too permissive
+    spf_record, spf_permissive, spf_temporary_failure = await spf.check(domain)
+    if spf_permissive:
         spoofable = True
+    if spf_temporary_failure:
+        temporary_failure = True
 
     try:
         # Get the DMARC record for the domain
-        dmarc_records = dns.resolver.resolve("_dmarc." + domain, "TXT")
+        dmarc_records = await dns.asyncresolver.resolve("_dmarc." + domain, "TXT")
         for txt_record in dmarc_records:
             if txt_record.to_text().startswith('"v=DMARC1'):
                 dmarc_record_raw = txt_record.to_text()
@@ -45,8 +53,10 @@ async def check(domain: str):
                 if "p=none" in dmarc_record_raw:
                     spoofable = True
                 break
+    except TEMPORARY_ERRORS:
+        temporary_failure = True
     except:
         # No DMARC record found, domain might be spoofable
         spoofable = True
 
-    return mx_record, spf_record, dmarc_record, spoofable
+    return mx_record, spf_record, dmarc_record, spoofable, temporary_failure
@@ -0,0 +1,85 @@
+import idna
+
+# Providers whose mailboxes have several spellings, keyed by canonical domain.
+# "aliases" are other domains delivering to the same mailboxes, "ignore_dots"
+# drops dots from the local part and "tag_separator" starts a sub-address tag
+# that is stripped. Add providers with `register`.
+PROVIDERS = {
+    "gmail.com": {
+        "aliases": ("googlemail.com",),
+        "ignore_dots": True,
+        "tag_separator": "+",
+    },
+    "outlook.com": {"tag_separator": "+"},
+    "hotmail.com": {"tag_separator": "+"},
+    "live.com": {"tag_separator": "+"},
+    "icloud.com": {"tag_separator": "+"},
+    "proton.me": {"tag_separator": "+"},
+    "protonmail.com": {"tag_separator": "+"},
+    "fastmail.com": {"tag_separator": "+"},
+    "yandex.ru": {
+        "aliases": ("ya.ru", "yandex.com", "yandex.by", "yandex.kz", "yandex.ua"),
+        "tag_separator": "+",
+    },
+}
+
+# alias domain -> canonical domain
+_aliases = {}
+
+
+def register(domain: str, aliases=(), ignore_dots=False, tag_separator=None):
+    """Add or replace the mailbox rules of a provider."""
+    PROVIDERS[domain] = {
+        "aliases": tuple(aliases),
+        "ignore_dots": ignore_dots,
+        "tag_separator": tag_separator,
+    }
+    for alias in aliases:
+        _aliases[alias] = domain
+
+
+for _domain, _rules in PROVIDERS.items():
+    for _alias in _rules.get("aliases", ()):
+        _aliases[_alias] = _domain
+
+
+def idna_domain(domain: str) -> str:
+    """Lowercase a domain and convert it to IDNA."""
+    domain = domain.strip().rstrip(".").lower()
+    try:
+        return idna.encode(domain, uts46=True).decode("ascii")
+    except idna.IDNAError:
+        return domain
+
+
+def idna_address(email: str) -> str:
+    """Convert the domain of an address to IDNA, keeping the local part."""
+    if "@" not in email:
+        return email
+    local, domain = email.rsplit("@", 1)
+    return f"{local}@{idna_domain(domain)}"
+
+
+def canonical_domain(domain: str) -> str:
+    """Normalize a domain with `idna_domain` and resolve provider aliases."""
+    domain = idna_domain(domain)
+    return _aliases.get(domain, domain)
+
+
+def canonical_address(email: str) -> str:
+    """
+    Return the key of the mailbox an address delivers to, so equivalent
+    spellings (John.Doe+promo@gmail.com, johndoe@googlemail.com) share it.
+    """
+    local, domain = email.rsplit("@", 1)
+    domain = canonical_domain(domain)
+    rules = PROVIDERS.get(domain, {})
+
+    canonical_local = local.lower()
+    separator = rules.get("tag_separator")
+    if separator and separator in canonical_local:
+        canonical_local = canonical_local.split(separator, 1)[0]
+    if rules.get("ignore_dots"):
+        canonical_local = canonical_local.replace(".", "")
+
+    return f"{canonical_local or local.lower()}@{domain}"
@@ -30,9 +30,10 @@ async def check(
     if dmarc_record and ("ruf=" in dmarc_record):
         score += 1  # Forensic reports set up
 
-    score += (
-        2 if deliverable else -2
-    )  # Increase points for deliverable, penalize undeliverable more
+    if deliverable is not None:  # Unknown when the SMTP probe could not tell
+        score += (
+            2 if deliverable else -2
+        )  # Increase points for deliverable, penalize undeliverable more
 
     # Subtract points for negative indicators
     if randomness:
@@ -2,6 +2,10 @@ import smtplib
 import random
 import string
 import socket
+from app.diagnostics import profiling
+from app.email_functions import mx_limits
+
+SMTP_TIMEOUT = 10
 
 
 def generate_random_email(domain: str) -> str:
@@ -9,31 +13,94 @@ def generate_random_email(domain: str) -> str:
     return f"{random_username}@{domain}"
 
 
-def check(email: str, mx_record: str, domain: str):
-    try:
-        random_email = generate_random_email(domain)
-        server = smtplib.SMTP(mx_record)
+def probe(email: str, mx_record: str, domain: str, catch_all: bool = None):
+    """
+    Run the SMTP conversation and return the RCPT codes for the address and,
+    unless the domain's catch-all status is already known, a random address.
+    """
+    server = smtplib.SMTP(mx_record, timeout=SMTP_TIMEOUT)
 
-        # SMTP conversation
-        server.set_debuglevel(0)
-        server.ehlo()
-        server.mail("")
+    # SMTP conversation
+    server.set_debuglevel(0)
+    server.ehlo()
+    # A refused MAIL (e.g. greylisting) would make every RCPT fail with 503
+    code, message = server.mail("")
+    if code != 250:
+        server.quit()
+        raise smtplib.SMTPSenderRefused(code, message, "")
 
-        primary_response = server.rcpt(email)
+    primary_response = server.rcpt(email)
+    random_email_response = (None,)
+    if catch_all is None:
+        random_email = generate_random_email(domain)
         random_email_response = server.rcpt(random_email)
-        server.quit()
+    server.quit()
+
+    return primary_response[0], random_email_response[0]
+
+
+async def check(email: str, mx_record: str, domain: str, catch_all: bool = None):
+    """
+    Probe the MX for an address within the MX host's concurrency limits.
+    Returns (deliverable, catch_all), with deliverable None when it is unknown:
+    the host's circuit breaker is open, its queue is full, it timed out or it
+    answered with a temporary 4xx (throttling, greylisting).
+    """
+    if not mx_record:
+        return False, catch_all
+
+    try:
+        async with mx_limits.slot(mx_record) as breaker:
+            try:
+                primary_code, random_email_code = await profiling.to_thread(
+                    probe, email, mx_record, domain, catch_all, name="smtp probe"
+                )
+            except (
+                socket.timeout,
+                ConnectionError,
+                smtplib.SMTPServerDisconnected,
+            ) as e:
+                print(f"SMTP Error: {e}")
+                breaker.record_failure()
+                return None, catch_all
+            except smtplib.SMTPResponseException as e:
+                print(f"SMTP Error: {e}")
+                # A 4xx greeting or MAIL reply is throttling or greylisting
+                if 400 <= e.smtp_code < 500:
+                    breaker.record_failure()
+                    return None, catch_all
+                return False, catch_all
+            except socket.gaierror as e:
+                # The MX host does not resolve, nothing can be delivered to it
+                print(f"SMTP Error: {e}")
+                return False, catch_all
+            except OSError as e:
+                # Unreachable hosts and other network errors
+                print(f"SMTP Error: {e}")
+                breaker.record_failure()
+                return None, catch_all
+            except smtplib.SMTPException as e:
+                print(f"SMTP Error: {e}")
+                return False, catch_all
+
+            if 400 <= primary_code < 500 or (
+                random_email_code and 400 <= random_email_code < 500
+            ):
+                breaker.record_failure()
+                return None, catch_all
+            breaker.record_success()
+    except mx_limits.Unavailable as e:
+        print(f"SMTP probe skipped: {e}")
+        return None, catch_all
+
+    if catch_all is not None:
+        return primary_code == 250, catch_all
 
-        primary_code = primary_response[0]
-        random_email_code = random_email_response[0]
-
-        if primary_code == 250 and random_email_code == 250:
-            return True, True  # Email exists and domain is a catch-all
-        elif primary_code == 550 and random_email_code == 250:
-            return False, True  # Email does not exist but domain is a catch-all
-        elif primary_code == 250 and random_email_code == 550:
-            return True, False  # Email exists and domain is not a catch-all
-        else:
-            return False, False  # Email does not exist and domain is not a catch-all
-    except (socket.gaierror, socket.error, socket.herror, smtplib.SMTPException) as e:
-        print(f"SMTP Error: {e}")
-        return False, False
+    if primary_code == 250 and random_email_code == 250:
+        return True, True  # Email exists and domain is a catch-all
+    elif primary_code == 550 and random_email_code == 250:
+        return False, True  # Email does not exist but domain is a catch-all
+    elif primary_code == 250 and random_email_code == 550:
+        return True, False  # Email exists and domain is not a catch-all
+    else:
+        return False, False  # Email does not exist and domain is not a catch-all
@@ -0,0 +1,187 @@
+import asyncio
+import time
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+
+# RFC 7208 limits on DNS-querying terms and on how deep we follow includes
+MAX_LOOKUPS = 10
+MAX_DEPTH = 10
+
+# Bounds on how long evaluated records are cached
+MIN_TTL = 60
+MAX_TTL = 3600
+NEGATIVE_TTL = 300
+CACHE_SIZE = 10000
+
+LOOKUP_MECHANISMS = ("include", "a", "mx", "ptr", "exists")
+
+resolver = dns.asyncresolver.Resolver()
+resolver.lifetime = 5
+
+# name -> (expires, evaluation). Every domain evaluates the same few includes
+# (_spf.google.com, spf.protection.outlook.com, ...), so evaluated subtrees of
+# the include graph are shared between all domains that reference them.
+_evaluated = {}
+
+# name -> in-flight TXT lookup, so concurrent evaluations share one query
+_inflight = {}
+
+
+def parse(record: str) -> list:
+    """Split an SPF record into (qualifier, name, value) terms."""
+    terms = []
+    for term in record.split()[1:]:
+        qualifier = "+"
+        if term[0] in "+-~?":
+            qualifier, term = term[0], term[1:]
+        if "=" in term and ":" not in term.split("=")[0]:
+            name, value = term.split("=", 1)
+        else:
+            name, _, value = term.partition(":")
+            name = name.split("/")[0]
+        terms.append((qualifier, name.lower(), value))
+    return terms
+
+
+async def _lookup(name: str):
+    """Return (record, ttl, error) for the SPF record published at a name."""
+    try:
+        answer = await resolver.resolve(name, "TXT")
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return None, NEGATIVE_TTL, "none"
+    except (dns.exception.Timeout, dns.resolver.NoNameservers):
+        return None, MIN_TTL, "temperror"
+    except dns.exception.DNSException:
+        return None, NEGATIVE_TTL, "permerror"
+
+    records = [
+        b"".join(txt_record.strings).decode(errors="replace") for txt_record in answer
+    ]
+    records = [r for r in records if r.lower().split(" ")[0] == "v=spf1"]
+    ttl = min(max(answer.rrset.ttl, MIN_TTL), MAX_TTL)
+    if not records:
+        return None, ttl, "none"
+    if len(records) > 1:
+        return records[0], ttl, "permerror"
+    return records[0], ttl, None
+
+
+async def _fetch(name: str):
+    if name not in _inflight:
+        _inflight[name] = asyncio.ensure_future(_lookup(name))
+        _inflight[name].add_done_callback(lambda _: _inflight.pop(name, None))
+    # Shielded, so one cancelled caller does not cancel the lookup for the rest
+    return await asyncio.shield(_inflight[name])
+
+
+def _remember(name: str, evaluation: dict):
+    now = time.monotonic()
+    if len(_evaluated) >= CACHE_SIZE:
+        for cached in [n for n, (expires, _) in _evaluated.items() if expires < now]:
+            del _evaluated[cached]
+        if len(_evaluated) >= CACHE_SIZE:
+            _evaluated.clear()
+    _evaluated[name] = (now + evaluation["ttl"], evaluation)
+
+
+async def evaluate(name: str, _chain: tuple = ()) -> dict:
+    """
+    Work out the effective policy of the SPF record at a name, following
+    include: and redirect= recursively. The result holds the record, the
+    qualifier of the `all` that unmatched senders end up at (an include whose
+    own policy is +all matches every sender), the number of DNS lookups the
+    whole tree needs and an error of none, temperror or permerror.
+    """
+    name = name.lower().rstrip(".")
+
+    cached = _evaluated.get(name)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    if name in _chain or len(_chain) >= MAX_DEPTH:
+        return {
+            "record": None,
+            "all": None,
+            "lookups": 0,
+            "error": "permerror",
+            "ttl": MIN_TTL,
+        }
+
+    record, ttl, error = await _fetch(name)
+    evaluation = {
+        "record": record,
+        "all": None,
+        "lookups": 0,
+        "error": error,
+        "ttl": ttl,
+    }
+    if record is None:
+        _remember(name, evaluation)
+        return evaluation
+
+    terms = parse(record)
+    has_all = any(term == "all" for _, term, _ in terms)
+    # Targets built from macros depend on the sender and cannot be followed here
+    targets = [
+        value for _, term, value in terms if term == "include" and "%" not in value
+    ]
+    redirect = next((value for _, term, value in terms if term == "redirect"), None)
+    if redirect and "%" not in redirect and not has_all:
+        targets.append(redirect)
+
+    # Sibling includes are independent, so resolve them concurrently
+    children = await asyncio.gather(
+        *(evaluate(target, _chain + (name,)) for target in targets)
+    )
+    children = dict(zip(targets, children))
+
+    for qualifier, term, value in terms:
+        if term in LOOKUP_MECHANISMS:
+            evaluation["lookups"] += 1
+        if term == "include" and value in children:
+            child = children[value]
+            evaluation["lookups"] += child["lookups"]
+            evaluation["ttl"] = min(evaluation["ttl"], child["ttl"])
+            if child["error"]:
+                evaluation["error"] = evaluation["error"] or (
+                    "temperror" if child["error"] == "temperror" else "permerror"
+                )
+            elif child["all"] == "+" and evaluation["all"] is None:
+                # The include passes every sender, so this term matches them all
+                evaluation["all"] = qualifier
+        elif term == "all" and evaluation["all"] is None:
+            evaluation["all"] = qualifier
+
+    if redirect in children and not has_all:
+        child = children[redirect]
+        evaluation["lookups"] += 1 + child["lookups"]
+        evaluation["ttl"] = min(evaluation["ttl"], child["ttl"])
+        evaluation["error"] = evaluation["error"] or (
+            "permerror" if child["error"] == "none" else child["error"]
+        )
+        if evaluation["all"] is None:
+            evaluation["all"] = child["all"]
+
+    if evaluation["lookups"] > MAX_LOOKUPS:
+        evaluation["error"] = "permerror"
+
+    _remember(name, evaluation)
+    return evaluation
+
+
+async def check(domain: str):
+    """
+    Return the domain's SPF record (or False), whether its effective policy
+    lets anyone send as the domain (no record, a +all reached directly or
+    through includes, too many DNS lookups or an otherwise broken record) and
+    whether the evaluation hit a temporary DNS error, which says nothing about
+    the policy.
+    """
+    evaluation = await evaluate(domain)
+    spf_record = evaluation["record"] or False
+    temporary_failure = evaluation["error"] == "temperror"
+    permissive = (
+        evaluation["error"] in ("none", "permerror") or evaluation["all"] == "+"
+    )
+    return spf_record, permissive, temporary_failure
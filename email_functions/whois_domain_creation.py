@@ -1,10 +1,16 @@
 import whois
 from datetime import datetime
+from app.diagnostics import profiling
 
 
 async def check(domain: str) -> int:
+    """
+    Return the days since the domain was created, -1 when the registry does not
+    publish a creation date and None when the lookup itself failed.
+    """
     try:
-        domain_info = whois.whois(domain)
+        # The WHOIS client blocks on its socket, so it runs in a worker thread
+        domain_info = await profiling.to_thread(whois.whois, domain, name="whois")
         creation_date = (
             domain_info.creation_date[0]
             if type(domain_info.creation_date) is list
@@ -17,4 +23,4 @@ async def check(domain: str) -> int:
             return -1  # If creation date is not available
     except Exception as e:
         print(f"An error occurred: {e}")
-        return -1
+        return None
@@ -1,4 +1,6 @@
 from typing import Union
+import hmac
+import os
 import re
 import json
 from fastapi import FastAPI, Request, Form, Body, HTTPException
@@ -6,16 +8,18 @@ from starlette.responses import HTMLResponse, JSONResponse, Response
 from starlette.templating import Jinja2Templates
 from starlette.staticfiles import StaticFiles
 from app.email_functions import (
+    normalize,
     smtp,
-    mx_spf_dmarc,
-    spamhaus_dbl,
-    whois_domain_creation,
+    mx_limits,
+    domain_intel,
     reputation,
     random_email,
 )
 import time
 import bleach
-from app.dbo import db_domain, db_email, db_history
+from app.dbo import db_email, db_history, db_jobs
+from app.workers import job_queue, refresh_scheduler
+from app.diagnostics import profiling
 from slowapi import Limiter
 from pydantic import BaseModel
 
@@ -24,6 +28,18 @@ class EmailRequestBody(BaseModel):
     email: str | None = None
 
 
+class ProfilingSettingsBody(BaseModel):
+    enabled: bool | None = None
+    sample_rate: float | None = None
+    block_threshold_ms: int | None = None
+
+
+class JobRequestBody(BaseModel):
+    emails: list[str] = []
+    priority: str = "normal"
+    max_concurrency: int = 4
+
+
 def get_real_address(request: Request) -> Union[str, None]:
     forwarded_for = request.headers.get("X-Forwarded-For")
     if forwarded_for:
@@ -33,6 +49,36 @@ def get_real_address(request: Request) -> Union[str, None]:
     return real_ip
 
 
+def is_admin(request: Request) -> bool:
+    """Check that the request carries the operator token from ADMIN_TOKEN."""
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    provided = request.headers.get("X-Admin-Token", "")
+    return bool(admin_token) and hmac.compare_digest(provided, admin_token)
+
+
+def require_admin(request: Request):
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+def has_job_key(request: Request) -> bool:
+    """
+    Jobs run one check per address, far past the per-request limits, so they
+    need one of the comma separated keys in JOB_API_KEYS in X-Api-Key.
+    """
+    provided = request.headers.get("X-Api-Key", "")
+    return is_admin(request) or any(
+        hmac.compare_digest(provided, key)
+        for key in os.environ.get("JOB_API_KEYS", "").split(",")
+        if key
+    )
+
+
+def profile_flagged(request: Request) -> bool:
+    """An operator can force profiling of a single request with X-Profile: 1."""
+    return request.headers.get("X-Profile") == "1" and is_admin(request)
+
+
 app = FastAPI(
     redoc_url=None,
     description="""
@@ -56,6 +102,20 @@ The API accepts a POST request with a JSON body containing the email address to
 {
     "email": "example@example.org"
 }
+```
+
+### Jobs
+
+Large lists are verified asynchronously. POST a JSON body with up to 10,000 addresses to https://mailunveil.com/api/v1/jobs
+and poll `/api/v1/jobs/{job_id}` for progress and `/api/v1/jobs/{job_id}/results` for paged results.
+Jobs need an API key in the `X-Api-Key` header. `priority` is `normal` or `bulk`.
+
+```json
+{
+    "emails": ["example@example.org", "another@example.org"],
+    "priority": "normal",
+    "max_concurrency": 4
+}
 ```
               """,
     docs_url="/docs",
@@ -84,121 +144,142 @@ with open("/app/lists/malicious_domains.txt", "r") as f:
 with open("/app/tlds/suspicious_tlds.txt", "r") as f:
     suspicious_tlds = set(f.read().splitlines())
 
+EMAIL_PATTERN = re.compile(
+    r"^[_a-z0-9+-]+(\.[_a-z0-9+-]+)*@[a-z0-9-]+(\.[a-z0-9-]+)*"
+    r"(\.([a-z]{2,4}|xn--[a-z0-9-]+))$"
+)
 
-@app.get("/", response_class=HTMLResponse, include_in_schema=False)
-async def get(request: Request):
-    context = {"request": request}
-    return templates.TemplateResponse("index.html", context)
-
-
-@app.post("/index_check", response_class=JSONResponse, include_in_schema=False)
-@limiter.limit("10/minute")
-async def page_check(request: Request, response: Response, email: str = Form(...)):
-    start_time = time.time()
-
-    email = bleach.clean(email)
-
-    match = re.match(
-        "^[_a-z0-9-]+(\.[_a-z0-9-]+)*@[a-z0-9-]+(\.[a-z0-9-]+)*(\.[a-z]{2,4})$",
-        email.lower(),
-    )
-
-    if match:
-        # Format domain
-
-        domain = email.split("@")[1]
 
-        # Check for suspicious TLDs
+async def check_email(email: str, canonical: str) -> dict:
+    """
+    Run every check for a valid email address and store the results. Domain
+    checks run on the submitted domain; the SMTP probe and storage use the
+    canonical mailbox key, so equivalent spellings of an address share them.
+    """
 
-        suspicious_tld = domain.split(".")[-1] in suspicious_tlds
+    # Format domain
 
-        # Check MX, SPF, DMARC
+    domain = normalize.idna_domain(email.rsplit("@", 1)[1])
 
-        mx_record, spf_record, dmarc_record, spoofable = await mx_spf_dmarc.check(
-            domain
-        )
+    refresh_scheduler.record(domain)
 
-        # Check SMTP
+    # Check for suspicious TLDs
 
-        deliverable, catch_all = smtp.check(email, mx_record, domain)
+    suspicious_tld = domain.split(".")[-1] in suspicious_tlds
 
-        # Check Spamhaus DBL
+    # Check MX, SPF, DMARC, DNS blocklists and days since domain creation,
+    # reusing whatever is still fresh in the domains table
 
-        spam_domain = await spamhaus_dbl.check(email)
+    domain_record = await domain_intel.check(domain)
+    mx_record = domain_record["primary_mx"]
+    spf_record = domain_record["spf_record"]
+    dmarc_record = domain_record["dmarc_record"]
+    spoofable = domain_record["spoofable"]
+    spam_domain = domain_record["spam"]
+    spam_categories = domain_intel.dnsbl_categories(domain_record)
+    domain_days_since_creation = domain_intel.days_since_creation(domain_record)
 
-        # Check Phishing Domains
+    # Check SMTP
 
-        phishing_domain = (
-            domain.lower() in phishing_domains or domain.lower() in malicious_domains
+    if not mx_record and domain_intel.lookup_failed(domain_record, "dns"):
+        # The MX lookup failed temporarily, so deliverability is unknown
+        deliverable, catch_all = None, domain_record["catch_all"]
+    else:
+        deliverable, catch_all = await smtp.check(
+            canonical, mx_record, domain, domain_record["catch_all"]
         )
+    domain_intel.set_catch_all(domain_record, catch_all)
 
-        # Check if disposable email
-
-        disposable_domain = domain.lower() in disposable_domains
+    # Check Phishing Domains
 
-        # Check days since domain creation
+    phishing_domain = (
+        domain.lower() in phishing_domains
+        or domain.lower() in malicious_domains
+        or "phishing" in spam_categories
+        or "malware" in spam_categories
+    )
 
-        domain_days_since_creation = await whois_domain_creation.check(domain)
+    # Check if disposable email
 
-        # Check for email randomness
+    disposable_domain = domain.lower() in disposable_domains
 
-        randomness = await random_email.check(email)
+    # Check for email randomness
 
-        # Check reputation
+    randomness = await random_email.check(canonical)
 
-        reputation_text, score = await reputation.check(
-            spf_record,
-            dmarc_record,
-            spam_domain,
-            phishing_domain,
-            disposable_domain,
-            domain_days_since_creation < 30,
-            suspicious_tld,
-            spoofable,
-            deliverable,
-            catch_all,
-            randomness,
-        )
+    # Check reputation
 
-        domain_info = (
-            domain,
-            domain.split(".")[-1],
-            mx_record,
-            spf_record,
-            dmarc_record,
-            domain_days_since_creation,
-            domain_days_since_creation < 30,
-            disposable_domain,
-            spam_domain,
-            phishing_domain,
-            suspicious_tld,
-            catch_all,
-        )
+    reputation_text, score = await reputation.check(
+        spf_record,
+        dmarc_record,
+        spam_domain,
+        phishing_domain,
+        disposable_domain,
+        domain_days_since_creation < 30,
+        suspicious_tld,
+        spoofable,
+        deliverable,
+        catch_all,
+        randomness,
+    )
 
-        await db_domain.insert_or_update(domain_info)
+    domain_record.update(
+        disposable=disposable_domain,
+        phishing=phishing_domain,
+        suspicious=suspicious_tld,
+    )
 
-        email_info = (
-            email,
-            score,
-            reputation_text,
-            match is not None,
-            deliverable,  # This should be updated with the actual check
-            spoofable,
-        )
+    await domain_intel.save(domain_record)
 
-        await db_email.insert_or_update(email_info)
+    email_info = (
+        canonical,
+        score,
+        reputation_text,
+        True,
+        deliverable,  # This should be updated with the actual check
+        spoofable,
+    )
 
-        first_seen, last_updated = await db_history.check(email)
+    await db_email.insert_or_update(email_info)
 
-        end_time = time.time()
+    first_seen, last_updated = await db_history.check(canonical)
 
-        response_time = end_time - start_time
+    return {
+        "email": {
+            "address": email,
+            "canonical_address": canonical,
+            "valid": True,
+            "deliverable": deliverable,
+            "spoofable": spoofable,
+            "first_seen": first_seen,
+            "last_updated": last_updated,
+        },
+        "domain": {
+            "domain_name": domain,
+            "tld": domain.split(".")[-1],
+            "suspicious_tld": suspicious_tld,
+            "primary_mx": mx_record,
+            "spf_record": spf_record,
+            "dmarc_record": dmarc_record,
+            "catch_all": catch_all,
+            "domain_days_since_creation": domain_days_since_creation,
+            "new_domain": domain_days_since_creation < 30,
+            "disposable_domain": disposable_domain,
+            "spam_domain": spam_domain,
+            "spam_categories": spam_categories,
+            "phishing_domain": phishing_domain,
+        },
+        "reputation": {
+            "text": reputation_text,
+            "score": score,
+        },
+    }
 
-    else:
-        end_time = time.time()
 
-        response_time = end_time - start_time
+def check_response(start_time: float, data: dict = None) -> Response:
+    response_time = time.time() - start_time
 
+    if data is None:
         formatted_json = json.dumps(
             {
                 "status": 400,
@@ -215,34 +296,7 @@ async def page_check(request: Request, response: Response, email: str = Form(...
         {
             "status": 200,
             "response_time": round(response_time, 2),
-            "data": {
-                "email": {
-                    "address": email,
-                    "valid": match is not None,
-                    "deliverable": deliverable,
-                    "spoofable": spoofable,
-                    "first_seen": first_seen,
-                    "last_updated": last_updated,
-                },
-                "domain": {
-                    "domain_name": domain,
-                    "tld": domain.split(".")[-1],
-                    "suspicious_tld": suspicious_tld,
-                    "primary_mx": mx_record,
-                    "spf_record": spf_record,
-                    "dmarc_record": dmarc_record,
-                    "catch_all": catch_all,
-                    "domain_days_since_creation": domain_days_since_creation,
-                    "new_domain": domain_days_since_creation < 30,
-                    "disposable_domain": disposable_domain,
-                    "spam_domain": spam_domain,
-                    "phishing_domain": phishing_domain,
-                },
-                "reputation": {
-                    "text": reputation_text,
-                    "score": score,
-                },
-            },
+            "data": data,
         },
         indent=2,
     )
@@ -252,6 +306,43 @@ async def page_check(request: Request, response: Response, email: str = Form(...
     )
 
 
+@app.on_event("startup")
+async def start_workers():
+    job_queue.start(check_email)
+    refresh_scheduler.start()
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    job_queue.stop()
+    refresh_scheduler.stop()
+
+
+@app.get("/", response_class=HTMLResponse, include_in_schema=False)
+async def get(request: Request):
+    context = {"request": request}
+    return templates.TemplateResponse("index.html", context)
+
+
+@app.post("/index_check", response_class=JSONResponse, include_in_schema=False)
+@limiter.limit("10/minute")
+async def page_check(request: Request, response: Response, email: str = Form(...)):
+    start_time = time.time()
+
+    # Unicode domains are validated and keyed on their IDNA form
+    email = normalize.idna_address(bleach.clean(email))
+
+    if not EMAIL_PATTERN.match(email.lower()):
+        return check_response(start_time)
+
+    async with refresh_scheduler.live_request(), profiling.profile(
+        "/index_check", profile_flagged(request)
+    ):
+        data = await check_email(email, normalize.canonical_address(email))
+
+    return check_response(start_time, data)
+
+
 @app.post(
     "/api/v1/check",
     response_class=JSONResponse,
@@ -271,6 +362,7 @@ async def page_check(request: Request, response: Response, email: str = Form(...
                         "data": {
                             "email": {
                                 "address": "example@example.org",
+                                "canonical_address": "example@example.org",
                                 "valid": True,
                                 "deliverable": True,
                                 "spoofable": False,
@@ -289,6 +381,7 @@ async def page_check(request: Request, response: Response, email: str = Form(...
                                 "new_domain": False,
                                 "disposable_domain": False,
                                 "spam_domain": False,
+                                "spam_categories": [],
                                 "phishing_domain": False,
                             },
                             "reputation": {
@@ -333,159 +426,225 @@ async def api_check(
     if not email:
         return JSONResponse(status_code=400, content={"error": "No email provided"})
 
-    email = bleach.clean(email)
+    # Unicode domains are validated and keyed on their IDNA form
+    email = normalize.idna_address(bleach.clean(email))
 
     start_time = time.time()
 
-    match = re.match(
-        "^[_a-z0-9-]+(\.[_a-z0-9-]+)*@[a-z0-9-]+(\.[a-z0-9-]+)*(\.[a-z]{2,4})$",
-        email.lower(),
-    )
+    if not EMAIL_PATTERN.match(email.lower()):
+        return check_response(start_time)
 
-    if match:
-        # Format domain
+    async with refresh_scheduler.live_request(), profiling.profile(
+        "/api/v1/check", profile_flagged(request)
+    ):
+        data = await check_email(email, normalize.canonical_address(email))
 
-        domain = email.split("@")[1]
+    return check_response(start_time, data)
 
-        # Check for suspicious TLDs
 
-        suspicious_tld = domain.split(".")[-1] in suspicious_tlds
+@app.post(
+    "/api/v1/jobs",
+    response_class=JSONResponse,
+    summary="Submit a list of email addresses for asynchronous checking",
+    response_description="Returns the id of the job to poll for progress and results",
+    tags=["API"],
+)
+@limiter.limit("10/minute")
+async def api_submit_job(
+    request: Request,
+    response: Response,
+    job_body: JobRequestBody = Body(default=None),
+):
+    if not has_job_key(request):
+        return JSONResponse(status_code=401, content={"error": "Invalid API key"})
 
-        # Check MX, SPF, DMARC
+    if not job_body or not job_body.emails:
+        return JSONResponse(status_code=400, content={"error": "No emails provided"})
 
-        mx_record, spf_record, dmarc_record, spoofable = await mx_spf_dmarc.check(
-            domain
+    if len(job_body.emails) > job_queue.MAX_ITEMS:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"At most {job_queue.MAX_ITEMS} emails per job"},
         )
 
-        # Check SMTP
-
-        deliverable, catch_all = smtp.check(email, mx_record, domain)
-
-        # Check Spamhaus DBL
-
-        spam_domain = await spamhaus_dbl.check(email)
-
-        # Check Phishing Domains
-
-        phishing_domain = (
-            domain.lower() in phishing_domains or domain.lower() in malicious_domains
+    if job_body.priority not in job_queue.LANES:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Priority must be one of {', '.join(job_queue.LANES)}"},
         )
 
-        # Check if disposable email
-
-        disposable_domain = domain.lower() in disposable_domains
-
-        # Check days since domain creation
+    # The high lane is kept free for operators
+    if job_body.priority == "high" and not is_admin(request):
+        return JSONResponse(
+            status_code=403, content={"error": "High priority is reserved"}
+        )
 
-        domain_days_since_creation = await whois_domain_creation.check(domain)
+    max_concurrency = min(max(job_body.max_concurrency, 1), job_queue.MAX_CONCURRENCY)
+
+    # Equivalent spellings of a mailbox are only checked once, the later ones
+    # wait as duplicates and receive the result of the first
+    items = []
+    seen = set()
+    for position, email in enumerate(job_body.emails):
+        email = normalize.idna_address(bleach.clean(email))
+        if EMAIL_PATTERN.match(email.lower()):
+            canonical = normalize.canonical_address(email)
+            status = "duplicate" if canonical in seen else "pending"
+            seen.add(canonical)
+            items.append((position, email, canonical, status, None))
+        else:
+            items.append(
+                (
+                    position,
+                    email,
+                    None,
+                    "invalid",
+                    json.dumps({"error": "Invalid email address"}),
+                )
+            )
+
+    job_id = job_queue.new_job_id()
+    if not await db_jobs.create(
+        job_id, job_queue.LANES[job_body.priority], max_concurrency, items
+    ):
+        return JSONResponse(status_code=503, content={"error": "Job queue unavailable"})
+    job_queue.notify()
+
+    return JSONResponse(
+        status_code=202, content={"status": 202, "job_id": job_id, "total": len(items)}
+    )
 
-        # Check for email randomness
 
-        randomness = await random_email.check(email)
+@app.get(
+    "/api/v1/jobs/{job_id}",
+    response_class=JSONResponse,
+    summary="Get the progress of a job",
+    tags=["API"],
+)
+@limiter.limit("60/minute")
+async def api_job_progress(request: Request, response: Response, job_id: str):
+    job = await db_jobs.progress(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+
+    (priority, max_concurrency, total, created_at), counts = job
+    pending = (
+        counts.get("pending", 0) + counts.get("running", 0) + counts.get("duplicate", 0)
+    )
 
-        # Check reputation
+    return JSONResponse(
+        status_code=200,
+        content={
+            "status": 200,
+            "job_id": job_id,
+            "state": "running" if pending else "finished",
+            "priority": next(k for k, v in job_queue.LANES.items() if v == priority),
+            "max_concurrency": max_concurrency,
+            "created_at": db_history.datetime_to_string(created_at),
+            "total": total,
+            "completed": total - pending,
+            "counts": counts,
+        },
+    )
 
-        reputation_text, score = await reputation.check(
-            spf_record,
-            dmarc_record,
-            spam_domain,
-            phishing_domain,
-            disposable_domain,
-            domain_days_since_creation < 30,
-            suspicious_tld,
-            spoofable,
-            deliverable,
-            catch_all,
-            randomness,
-        )
 
-        domain_info = (
-            domain,
-            domain.split(".")[-1],
-            mx_record,
-            spf_record,
-            dmarc_record,
-            domain_days_since_creation,
-            domain_days_since_creation < 30,
-            disposable_domain,
-            spam_domain,
-            phishing_domain,
-            suspicious_tld,
-            catch_all,
+@app.get(
+    "/api/v1/jobs/{job_id}/results",
+    response_class=JSONResponse,
+    summary="Get a page of job results",
+    tags=["API"],
+)
+@limiter.limit("60/minute")
+async def api_job_results(
+    request: Request,
+    response: Response,
+    job_id: str,
+    page: int = 1,
+    page_size: int = 100,
+):
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 1000)
+
+    rows = await db_jobs.results(job_id, (page - 1) * page_size, page_size)
+    if rows is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+
+    results = []
+    for position, email, status, result in rows:
+        result = json.loads(result) if result else None
+        # Duplicates share the result of the first spelling of their mailbox,
+        # so it is reported under their own address
+        if result and "email" in result:
+            result["email"]["address"] = email
+        results.append(
+            {"position": position, "email": email, "status": status, "result": result}
         )
 
-        await db_domain.insert_or_update(domain_info)
-
-        email_info = (
-            email,
-            score,
-            reputation_text,
-            match is not None,
-            deliverable,  # This should be updated with the actual check
-            spoofable,
-        )
+    return JSONResponse(
+        status_code=200,
+        content={
+            "status": 200,
+            "job_id": job_id,
+            "page": page,
+            "page_size": page_size,
+            "results": results,
+        },
+    )
 
-        await db_email.insert_or_update(email_info)
 
-        first_seen, last_updated = await db_history.check(email)
+@app.get("/api/v1/admin/smtp", response_class=JSONResponse, include_in_schema=False)
+async def admin_smtp_status(request: Request):
+    require_admin(request)
+    return JSONResponse(status_code=200, content=mx_limits.status())
 
-        end_time = time.time()
 
-        response_time = end_time - start_time
+@app.get(
+    "/api/v1/admin/profiling", response_class=JSONResponse, include_in_schema=False
+)
+async def admin_profiling_settings(request: Request):
+    require_admin(request)
+    return JSONResponse(status_code=200, content=profiling.settings)
 
-    else:
-        end_time = time.time()
 
-        response_time = end_time - start_time
+@app.post(
+    "/api/v1/admin/profiling", response_class=JSONResponse, include_in_schema=False
+)
+async def admin_update_profiling_settings(
+    request: Request, settings_body: ProfilingSettingsBody = Body(default=None)
+):
+    require_admin(request)
+    if settings_body:
+        if settings_body.enabled is not None:
+            profiling.settings["enabled"] = settings_body.enabled
+        if settings_body.sample_rate is not None:
+            profiling.settings["sample_rate"] = min(
+                max(settings_body.sample_rate, 0), 1
+            )
+        if settings_body.block_threshold_ms is not None:
+            profiling.settings["block_threshold_ms"] = max(
+                settings_body.block_threshold_ms, 1
+            )
+    return JSONResponse(status_code=200, content=profiling.settings)
+
+
+@app.get("/api/v1/admin/profiles", response_class=JSONResponse, include_in_schema=False)
+async def admin_profiles(request: Request):
+    require_admin(request)
+    return JSONResponse(status_code=200, content=profiling.summary())
+
+
+@app.get("/api/v1/admin/profiles/{profile_id}", include_in_schema=False)
+async def admin_download_profile(
+    request: Request, profile_id: str, format: str = "json"
+):
+    require_admin(request)
+    profile = profiling.find(profile_id)
+    if profile is None:
+        return JSONResponse(status_code=404, content={"error": "Profile not found"})
 
-        formatted_json = json.dumps(
-            {
-                "status": 400,
-                "response_time": round(response_time, 2),
-                "error": "Invalid email address",
-            },
-            indent=2,
-        )
+    # "wall_clock" is in collapsed stack format, ready for flame graph tools
+    if format in ("wall_clock", "loop_cpu_profile"):
         return Response(
-            content=formatted_json, media_type="application/json", status_code=400
+            content=profile[format] or "", media_type="text/plain", status_code=200
         )
-
-    formatted_json = json.dumps(
-        {
-            "status": 200,
-            "response_time": round(response_time, 2),
-            "data": {
-                "email": {
-                    "address": email,
-                    "valid": match is not None,
-                    "deliverable": deliverable,
-                    "spoofable": spoofable,
-                    "first_seen": first_seen,
-                    "last_updated": last_updated,
-                },
-                "domain": {
-                    "domain_name": domain,
-                    "tld": domain.split(".")[-1],
-                    "suspicious_tld": suspicious_tld,
-                    "primary_mx": mx_record,
-                    "spf_record": spf_record,
-                    "dmarc_record": dmarc_record,
-                    "catch_all": catch_all,
-                    "domain_days_since_creation": domain_days_since_creation,
-                    "new_domain": domain_days_since_creation < 30,
-                    "disposable_domain": disposable_domain,
-                    "spam_domain": spam_domain,
-                    "phishing_domain": phishing_domain,
-                },
-                "reputation": {
-                    "text": reputation_text,
-                    "score": score,
-                },
-            },
-        },
-        indent=2,
-    )
-
-    return Response(
-        content=formatted_json, media_type="application/json", status_code=200
-    )
+    return JSONResponse(status_code=200, content=profile)
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import os
+import socket
+import uuid
+from app.dbo import db_jobs
+from app.email_functions import normalize
+
+# Priority lanes, lower values are served first
+LANES = {"high": 0, "normal": 1, "bulk": 2}
+
+# Workers per lane. A worker serves its own lane first and only picks up work
+# from lower-priority lanes when its own lane is empty, so bulk jobs can never
+# occupy the workers reserved for higher lanes.
+LANE_WORKERS = {
+    "high": int(os.environ.get("JOB_WORKERS_HIGH", 2)),
+    "normal": int(os.environ.get("JOB_WORKERS_NORMAL", 2)),
+    "bulk": int(os.environ.get("JOB_WORKERS_BULK", 1)),
+}
+
+MAX_ITEMS = 10000
+MAX_CONCURRENCY = 16
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 2
+MAX_POLL_INTERVAL = 30
+LEASE_SECONDS = 600
+
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_tasks = []
+
+# Set when a job is submitted on this node, so idle workers don't wait out
+# their poll interval
+_submitted = asyncio.Event()
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+async def _process(
+    check_email, job_id: str, position: int, email: str, canonical: str, attempts: int
+):
+    # Items queued before canonical addresses were stored have none
+    canonical = canonical or normalize.canonical_address(email)
+    try:
+        data = await check_email(email, canonical)
+    except Exception as e:
+        print(f"Job {job_id} item {position} failed: {e}")
+        if attempts >= MAX_ATTEMPTS:
+            await db_jobs.complete(
+                job_id,
+                position,
+                canonical,
+                "failed",
+                json.dumps({"error": "Check failed"}),
+            )
+        else:
+            await db_jobs.release(job_id, position)
+        return
+    await db_jobs.complete(job_id, position, canonical, "done", json.dumps(data))
+
+
+def notify():
+    """Wake the idle workers of this node after a job was submitted."""
+    _submitted.set()
+    _submitted.clear()
+
+
+async def _idle(interval: float):
+    try:
+        await asyncio.wait_for(_submitted.wait(), interval)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _worker(lane: str, index: int, check_email):
+    worker_id = f"{NODE_ID}:{lane}:{index}"
+    priorities = [p for p in LANES.values() if p >= LANES[lane]]
+    # An empty queue is polled less and less often, up to MAX_POLL_INTERVAL.
+    # Jobs submitted on other nodes are picked up within that interval.
+    interval = POLL_INTERVAL
+    while True:
+        try:
+            for priority in priorities:
+                item = await db_jobs.claim(priority, worker_id)
+                if item:
+                    await _process(check_email, *item)
+                    interval = POLL_INTERVAL
+                    break
+            else:
+                await _idle(interval)
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Job worker {worker_id} error: {e}")
+            await asyncio.sleep(POLL_INTERVAL)
+
+
+async def _reaper():
+    while True:
+        await asyncio.sleep(LEASE_SECONDS / 10)
+        try:
+            requeued = await db_jobs.requeue_expired(LEASE_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Job reaper error: {e}")
+            continue
+        if requeued:
+            print(f"Requeued {requeued} expired job items")
+
+
+def start(check_email):
+    """Start the background workers that drain the job queue."""
+    if _tasks:
+        return
+    for lane, count in LANE_WORKERS.items():
+        for index in range(count):
+            _tasks.append(asyncio.create_task(_worker(lane, index, check_email)))
+    _tasks.append(asyncio.create_task(_reaper()))
+
+
+def stop():
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager, nullcontext
+from datetime import timedelta
+from app.email_functions import domain_intel
+
+# Number of most requested domains kept warm
+TOP_DOMAINS = int(os.environ.get("REFRESH_TOP_DOMAINS", 100))
+
+# Domains are refreshed when any of their fields goes stale within this lead
+REFRESH_LEAD = timedelta(minutes=int(os.environ.get("REFRESH_LEAD_MINUTES", 15)))
+
+# Background concurrency budget for refreshes
+REFRESH_CONCURRENCY = int(os.environ.get("REFRESH_CONCURRENCY", 2))
+
+# Refreshes only start while fewer live requests than this are in flight
+MAX_LIVE_REQUESTS = int(os.environ.get("REFRESH_MAX_LIVE_REQUESTS", 2))
+
+# How long a refresh holds back for live traffic. After that it runs anyway,
+# but only one at a time, so hot domains are still kept warm under load.
+MAX_YIELD = int(os.environ.get("REFRESH_MAX_YIELD_SECONDS", 10))
+
+INTERVAL = 60
+HALF_LIFE = 3600
+MAX_TRACKED = 10000
+
+# domain -> (decayed request count, time of last update)
+_frequency = {}
+_live_requests = 0
+_tasks = []
+
+
+def _decayed(score: float, since: float, now: float) -> float:
+    return score * 0.5 ** ((now - since) / HALF_LIFE)
+
+
+def record(domain: str):
+    """Count a request for a domain, with older requests decaying over time."""
+    now = time.monotonic()
+    score, since = _frequency.get(domain, (0.0, now))
+    _frequency[domain] = (_decayed(score, since, now) + 1, now)
+
+    if len(_frequency) > MAX_TRACKED:
+        for cold, _ in hottest(len(_frequency))[MAX_TRACKED // 2 :]:
+            del _frequency[cold]
+
+
+def hottest(count: int) -> list:
+    """Return the `count` most requested domains with their decayed scores."""
+    now = time.monotonic()
+    scores = [
+        (domain, _decayed(score, since, now))
+        for domain, (score, since) in _frequency.items()
+    ]
+    return sorted(scores, key=lambda item: item[1], reverse=True)[:count]
+
+
+@asynccontextmanager
+async def live_request():
+    """Mark a live request as in flight so background refreshes hold back."""
+    global _live_requests
+    _live_requests += 1
+    try:
+        yield
+    finally:
+        _live_requests -= 1
+
+
+async def _yield_to_live_traffic() -> bool:
+    """Wait up to MAX_YIELD for live traffic to drop, return whether it did."""
+    deadline = time.monotonic() + MAX_YIELD
+    while _live_requests >= MAX_LIVE_REQUESTS:
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(0.5)
+    return True
+
+
+async def _refresh(domain: str, budget: asyncio.Semaphore, busy: asyncio.Semaphore):
+    # The budget is only taken once the gate opens, so waiting refreshes
+    # don't hold it
+    quiet = await _yield_to_live_traffic()
+    async with nullcontext() if quiet else busy, budget:
+        try:
+            await domain_intel.refresh(domain, REFRESH_LEAD)
+        except Exception as e:
+            print(f"Refresh of {domain} failed: {e}")
+
+
+async def _scheduler():
+    budget = asyncio.Semaphore(REFRESH_CONCURRENCY)
+    busy = asyncio.Semaphore(1)
+    while True:
+        await asyncio.sleep(INTERVAL)
+        try:
+            await asyncio.gather(
+                *(_refresh(domain, budget, busy) for domain, _ in hottest(TOP_DOMAINS))
+            )
+        except Exception as e:
+            print(f"Refresh scheduler error: {e}")
+
+
+def start():
+    """Start the background task that keeps the most requested domains warm."""
+    if not _tasks:
+        _tasks.append(asyncio.create_task(_scheduler()))
+
+
+def stop():
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()